@@ -1,88 +1,179 @@
-import json
+import gc
+import platform
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlencode
 
 import blaze_client
 import requests
-from typing import List
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 from miabis_model import Biobank, Network, collection  # Assuming Biobank class is imported
 
-from miabis_model import Collection, Gender, StorageTemperature  # Assuming these classes are imported
+from miabis_model import Collection, Gender  # Assuming these classes are imported
+
+if platform.python_implementation() == "PyPy":
+    # orjson is a CPython extension, under PyPy the JIT-compiled stdlib parser is used instead
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode()
+else:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+
+# Print the FHIR representation of every synced resource
+DEBUG = False
+BLAZE_URL = 'http://localhost:8080/fhir'
+# FHIR id of the Organization that networks are attached to
+NETWORK_ORGANIZATION_FHIR_ID = 'DFFW3QMQC7KOYRHJ'
+DIRECTORY_GRAPHQL_URL = 'https://directory.bbmri-eric.eu/ERIC/directory/graphql'
+COLLECTIONS_GRAPHQL_URL = 'https://directory-emx2-acc.molgenis.net/ERIC/directory/graphql'
+# Timeout in seconds for requests to the Directory, the Collections query is slow to answer
+GRAPHQL_TIMEOUT = 60
+# Number of concurrent uploads to Blaze, matches the default connection pool size of requests
+UPLOAD_WORKERS = 10
+# Number of resources sent to Blaze in a single transaction Bundle
+BUNDLE_SIZE = 200
+# Timeout in seconds for a transaction Bundle, Blaze processes all of its entries before answering
+BUNDLE_TIMEOUT = 120
+# Number of identifiers looked up in a single FHIR search
+SEARCH_BATCH_SIZE = 100
+
+# Enum lookup tables
+GENDER_MAP = {gender.name: gender for gender in Gender}
+# Directory sex codes without a Gender member, "NAV" (not available) and "NASK" (not asked)
+SEX_ALIAS = {"NAV": "UNKNOWN", "NASK": "UNKNOWN"}
+# Any other unrecognised sex code is mapped to Gender.UNKNOWN as well
+
+# FHIR IDs of organizations found on a FHIR server, keyed by server URL and organization identifier
+_organization_fhir_ids: Dict[Tuple[str, str], str] = {}
+
+# Shared HTTP session, keeps connections alive between requests and retries transient failures
+SESSION = requests.Session()
+# Advertise every encoding urllib3 can decode, this includes br when brotli is installed
+SESSION.headers["Accept-Encoding"] = ACCEPT_ENCODING
+SESSION.mount("https://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.2,
+                                                        status_forcelist=(502, 503, 504), allowed_methods=None)))
+
+
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    """
+    Pause the cyclic garbage collector while bulk-allocating acyclic objects.
+
+    Decoding a response allocates thousands of dicts and lists that never form reference cycles,
+    yet each of them counts towards triggering a (full) collection.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
 
-def populate_collection_from_json(json_str: str) -> List[Collection]:
+def populate_collection_from_json(json_str: Union[str, bytes]) -> List[Collection]:
     """
-    Populate Collection objects from the JSON data.
+    Populate Collection objects from an undecoded JSON document.
+
+    Callers that already hold the decoded data should use populate_collection_from_dict instead.
     """
-    # Parse the JSON string into a Python list of dictionaries
-    json_data = json.loads(json_str)
+    # Parse the JSON document into a Python dictionary
+    return populate_collection_from_dict(json_loads(json_str))
 
-    collections = []
-    for collection_json in json_data.get("data", {}).get("Collections", []):
-        # Extract necessary fields from the JSON
-        identifier = collection_json.get("id", "")
-        name = collection_json.get("name", "")
-        description = collection_json.get("description", "unknown")
-        contact_info = collection_json.get("contact", {})  # Extract contact info from nested object
-        country = collection_json.get("country", {}).get("name", "unknown")  # Extract country name from nested object
-        sex = collection_json.get("sex", [])  # Extract gender information
-        age_low = collection_json.get("age_low")
-        age_high = collection_json.get("age_high")
-        storage_temperatures = collection_json.get("storage_temperatures", [])  # Extract storage temperatures
-        diagnoses = collection_json.get("diagnosis_available", [])
-        sample_types = collection_json.get("materials", [])
-        material_types = [StorageTemperature[sample_type.get("name")] for sample_type in sample_types if sample_type.get("name")]
-        managing_biobank_id = collection_json.get("biobank", {}).get("id", "")  # Extract managing biobank ID
-
-        # Extract contact details
-        contact_name = contact_info.get("first_name", "unknown")
-        contact_surname = contact_info.get("last_name", "unknown")
-        contact_email = contact_info.get("email", "unknown")
-
-        # Map genders to Gender enum
-        genders = [
-            Gender[("UNKNOWN" if (name := g.get("name")) == "NAV" or "NASK" else name).upper()]
-            for g in sex
-            if g.get("name") is not None
-        ]
-        # Map storage temperatures to StorageTemperature enum
-        #storage_temps = [StorageTemperature[temp.get("name")] for temp in storage_temperatures if temp.get("name")]
 
-        # Extract diagnosis codes
-        diagnosis_codes = [diagnosis.get("code") for diagnosis in diagnoses if diagnosis.get("code")]
+def populate_collection_from_dict(json_data: dict) -> List[Collection]:
+    """
+    Populate Collection objects from the already decoded JSON data.
+    """
+    return list(iter_collections(json_data))
 
-        # Extract material types
-        material_type_codes = [material.get("name") for material in material_types if material.get("name")]
 
-        # Create a Collection instance
+def iter_collections(json_data: dict) -> Iterator[Collection]:
+    """
+    Lazily build Collection objects from the decoded JSON data, skipping invalid records.
+    """
+    for collection_json in json_data.get("data", {}).get("Collections", []):
         try:
-            collection = Collection(
-                identifier=identifier,
-                name=name,
-                managing_biobank_id=managing_biobank_id,
-                contact_name=contact_name,
-                contact_surname=contact_surname,
-                contact_email=contact_email,
-                country=country,
-                genders=genders,
-                material_types=material_type_codes,
-                age_range_low=age_low,
-                age_range_high=age_high,
-                diagnoses=diagnosis_codes,
-                description=description
-            )
+            yield build_collection(collection_json)
+        except (KeyError, TypeError) as e:
+            print(f"Skipping malformed Collection record: {e!r}")
         except ValueError as e:
             print(f"Error creating Collection: {e}")
-            continue
 
-        collections.append(collection)
 
-    return collections
+def build_collection(collection_json: dict) -> Collection:
+    """
+    Build a single Collection object from one record of the JSON data.
+    """
+    # Extract necessary fields from the JSON
+    identifier = collection_json["id"]
+    name = collection_json["name"]
+    description = collection_json.get("description", "unknown")
+    contact_info = collection_json.get("contact") or {}  # Extract contact info from nested object
+    country = (collection_json.get("country") or {}).get("name", "unknown")  # Extract country name from nested object
+    sex = collection_json.get("sex") or []  # Extract gender information
+    age_low = collection_json.get("age_low")
+    age_high = collection_json.get("age_high")
+    diagnoses = collection_json.get("diagnosis_available") or []
+    sample_types = collection_json.get("materials") or []
+    managing_biobank_id = collection_json["biobank"]["id"]  # Extract managing biobank ID
+
+    # Extract contact details
+    contact_name = contact_info.get("first_name", "unknown")
+    contact_surname = contact_info.get("last_name", "unknown")
+    contact_email = contact_info.get("email", "unknown")
+
+    # Map genders to Gender enum
+    genders = [
+        GENDER_MAP.get(SEX_ALIAS.get(gender_code := gender_name.upper(), gender_code), Gender.UNKNOWN)
+        for g in sex
+        if (gender_name := g.get("name")) is not None
+    ]
+
+    # Extract diagnosis codes
+    diagnosis_codes = [code for diagnosis in diagnoses if (code := diagnosis.get("code"))]
+
+    # Extract material types
+    material_type_codes = [material_name for material in sample_types if (material_name := material.get("name"))]
+
+    # Create a Collection instance
+    return Collection(
+        identifier=identifier,
+        name=name,
+        managing_biobank_id=managing_biobank_id,
+        contact_name=contact_name,
+        contact_surname=contact_surname,
+        contact_email=contact_email,
+        country=country,
+        genders=genders,
+        material_types=material_type_codes,
+        age_range_low=age_low,
+        age_range_high=age_high,
+        diagnoses=diagnosis_codes,
+        description=description
+    )
+
+
 def fetch_quality_names(quality_data: list) -> List[str]:
     """
     Fetch all 'name' fields under the 'quality -> quality_standard -> name' path.
     """
     names = []
     for item in quality_data:
-        quality_standard = item.get("quality_standard", {})
+        quality_standard = item.get("quality_standard") or {}
         name = quality_standard.get("name")
         if name:
             names.append(name)
@@ -94,83 +185,100 @@ def populate_network_from_json(json_data: dict) -> List[Network]:
     """
     networks = []
     for network_json in json_data.get("data", {}).get("Networks", []):
-        # Extract necessary fields from the JSON
-        identifier = network_json.get("id", "")
-        name = network_json.get("name", "")
-        description = network_json.get("description", "")
-        juristic_person = network_json.get("juridical_person", "unknown")
-        contact_info = network_json.get("contact", {})  # Extract contact info from nested object
-        country = network_json.get("national_node", "unknown")
-        common_collaboration_topics = network_json.get("common_network_elements", "").split(",") if network_json.get("common_network_elements") else []
-
-        # Extract contact details
-        contact_name = contact_info.get("first_name", "unknown")
-        contact_surname = contact_info.get("last_name", "unknown")
-        contact_email = contact_info.get("email", "unknown")
-
-        # Assuming managing_biobank_id is not directly available in the JSON, you might need to derive it
-        managing_biobank_id = "bbmri-eric:ID:AT_MUG"  # Replace with actual logic to get this value
-
-        # Create a Network instance
-        network = Network(
-            identifier=identifier,
-            name=name,
-            managing_biobank_id=managing_biobank_id,
-            contact_email=contact_email,
-            country=country,
-            juristic_person=juristic_person,
-            members_collections_ids=[],  # Replace with actual member collection IDs if available
-            members_biobanks_ids=[],  # Replace with actual member biobank IDs if available
-            contact_name=contact_name,
-            contact_surname=contact_surname,
-            common_collaboration_topics=common_collaboration_topics,
-            description=description
-        )
-
-        networks.append(network)
-
+        try:
+            networks.append(build_network(network_json))
+        except (KeyError, TypeError) as e:
+            print(f"Skipping malformed Network record: {e!r}")
     return networks
 
+
+def build_network(network_json: dict) -> Network:
+    """
+    Build a single Network object from one record of the JSON data.
+    """
+    # Extract necessary fields from the JSON, juridical_person, national_node and common_network_elements
+    # are not part of networks_query and keep their defaults
+    identifier = network_json["id"]
+    name = network_json["name"]
+    description = network_json.get("description", "")
+    juristic_person = network_json.get("juridical_person", "unknown")
+    contact_info = network_json.get("contact") or {}  # Extract contact info from nested object
+    country = network_json.get("national_node", "unknown")
+    common_collaboration_topics = network_json.get("common_network_elements", "").split(",") if network_json.get("common_network_elements") else []
+
+    # Extract contact details
+    contact_name = contact_info.get("first_name", "unknown")
+    contact_surname = contact_info.get("last_name", "unknown")
+    contact_email = contact_info.get("email", "unknown")
+
+    # Assuming managing_biobank_id is not directly available in the JSON, you might need to derive it
+    managing_biobank_id = "bbmri-eric:ID:AT_MUG"  # Replace with actual logic to get this value
+
+    # Create a Network instance
+    return Network(
+        identifier=identifier,
+        name=name,
+        managing_biobank_id=managing_biobank_id,
+        contact_email=contact_email,
+        country=country,
+        juristic_person=juristic_person,
+        members_collections_ids=[],  # Replace with actual member collection IDs if available
+        members_biobanks_ids=[],  # Replace with actual member biobank IDs if available
+        contact_name=contact_name,
+        contact_surname=contact_surname,
+        common_collaboration_topics=common_collaboration_topics,
+        description=description
+    )
+
+
 def populate_biobank_from_json(json_data: dict) -> List[Biobank]:
     """
     Populate Biobank objects from the JSON data.
     """
     biobanks = []
     for biobank_json in json_data.get("data", {}).get("Biobanks", []):
-        # Extract necessary fields from the JSON
-        identifier = biobank_json.get("id", "")
-        name = biobank_json.get("name", "")
-        alias = biobank_json.get("acronym", "unknown")
-        country = biobank_json.get("country", {}).get("name", "")  # Extract country name from nested object
-        description = biobank_json.get("description", "")
-        contact_info = biobank_json.get("contact", {})  # Extract contact info from nested object
-
-        # Extract contact details
-        contact_name = contact_info.get("first_name", "unknown")
-        contact_surname = contact_info.get("last_name", "unknown")
-        contact_email = contact_info.get("email", "unknown")
-
-        # Extract quality management standards
-        quality_management_standards = fetch_quality_names(biobank_json.get("quality", []))
-
-        # Create a Biobank instance
-        biobank = Biobank(
-            identifier=identifier,
-            name=name,
-            alias=alias,
-            country=country,
-            contact_name=contact_name,
-            contact_surname=contact_surname,
-            contact_email=contact_email,
-            quality__management_standards=quality_management_standards,  # Not available in the JSON, leave as empty string
-            description=description
-        )
-
-        biobanks.append(biobank)
-
+        try:
+            biobanks.append(build_biobank(biobank_json))
+        except (KeyError, TypeError) as e:
+            print(f"Skipping malformed Biobank record: {e!r}")
     return biobanks
 
 
+def build_biobank(biobank_json: dict) -> Biobank:
+    """
+    Build a single Biobank object from one record of the JSON data.
+    """
+    # Extract necessary fields from the JSON
+    identifier = biobank_json["id"]
+    name = biobank_json["name"]
+    alias = biobank_json.get("acronym", "unknown")
+    # Biobanks outlive the decoded response, so their shared country names are interned
+    country = sys.intern((biobank_json.get("country") or {}).get("name") or "")  # Extract country name from nested object
+    description = biobank_json.get("description", "")
+    contact_info = biobank_json.get("contact") or {}  # Extract contact info from nested object
+
+    # Extract contact details
+    contact_name = contact_info.get("first_name", "unknown")
+    contact_surname = contact_info.get("last_name", "unknown")
+    contact_email = contact_info.get("email", "unknown")
+
+    # Extract quality management standards
+    quality_management_standards = fetch_quality_names(biobank_json.get("quality") or [])
+
+    # Create a Biobank instance
+    return Biobank(
+        identifier=identifier,
+        name=name,
+        alias=alias,
+        country=country,
+        contact_name=contact_name,
+        contact_surname=contact_surname,
+        contact_email=contact_email,
+        quality__management_standards=quality_management_standards,  # Not available in the JSON, leave as empty string
+        description=description
+    )
+
+
 # GraphQL query to fetch biobank data
 query = '''
 {
@@ -182,8 +290,6 @@ query = '''
             name
         }
         description
-        url
-        withdrawn
         contact {
             email
             first_name
@@ -202,9 +308,7 @@ networks_query = '''
     Networks {
         id
         name
-        acronym
         description
-        url
         contact {
             email
             first_name
@@ -218,64 +322,147 @@ collections_query = '''
     Collections {
         id
         name
-      biobank {
-        id
-      }
-      
-        acronym
+        biobank {
+            id
+        }
         description
-        url
         contact {
             email
             first_name
             last_name
         }
-      country {
-        name
-      }
-      sex {
-        name
-      }
-      age_low
-      age_high
-      storage_temperatures {
-        name
-      }
-      diagnosis_available {
-        code
-      }
-      number_of_donors
-      url
-      description
-      type {
-        name
-      }
-      access_description
+        country {
+            name
+        }
+        sex {
+            name
+        }
+        age_low
+        age_high
+        diagnosis_available {
+            code
+        }
+        materials {
+            name
+        }
     }
 }
 '''
 
+def print_fhir(resource) -> None:
+    """
+    Pretty-print a FHIR resource as JSON to stdout.
+    """
+    sys.stdout.flush()
+    sys.stdout.buffer.write(json_dumps(resource.as_json(), indent=True) + b"\n")
+
+
+def fetch_graphql(url: str, graphql_query: str) -> bytes:
+    """
+    Run a GraphQL query against the Directory and return the raw JSON response body.
+
+    :param url: The URL of the GraphQL endpoint.
+    :param graphql_query: The GraphQL query to run.
+    :return: The undecoded JSON response body.
+    :raises requests.exceptions.RequestException: If the request fails.
+    """
+    response = SESSION.post(url, json={'query': graphql_query}, timeout=GRAPHQL_TIMEOUT)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    return response.content
+
+
+def upload_concurrently(upload: Callable[[blaze_client.BlazeClient, Any], Any], resources: Iterable) -> None:
+    """
+    Upload resources to Blaze from UPLOAD_WORKERS threads.
+
+    Every worker thread uses its own BlazeClient, so no client state is shared between threads.
+    At most UPLOAD_WORKERS resources are pending at a time, so a lazily built iterable is only consumed
+    as fast as uploads finish.
+
+    :param upload: The BlazeClient method to call, e.g. blaze_client.BlazeClient.upload_collection.
+    :param resources: The resources to upload.
+    :raises Exception: The first exception raised by an upload.
+    """
+    local = threading.local()
+
+    def upload_one(resource) -> None:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = blaze_client.BlazeClient(blaze_url=BLAZE_URL, blaze_password="",
+                                                             blaze_username="")
+        upload(client, resource)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        pending = set()
+        for resource in resources:
+            if len(pending) >= UPLOAD_WORKERS:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()  # Re-raise upload errors
+            pending.add(executor.submit(upload_one, resource))
+        for future in pending:
+            future.result()
+
+
+def upload_biobank_bundle(fhir_server_url: str, biobanks: List[Biobank]) -> None:
+    """
+    Upload biobanks to the FHIR server in a single transaction Bundle.
+
+    Each Organization is created only if no Organization with the same identifier exists yet.
+
+    :param fhir_server_url: The base URL of the FHIR server (e.g., "https://fhir.example.com/fhir").
+    :param biobanks: The biobanks to upload.
+    :raises requests.exceptions.RequestException: If the transaction fails.
+    """
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": [
+            {
+                "resource": biobank.to_fhir().as_json(),
+                "request": {
+                    "method": "POST",
+                    "url": "Organization",
+                    "ifNoneExist": urlencode({"identifier": biobank.identifier})
+                }
+            }
+            for biobank in biobanks
+        ]
+    }
+    # Bundles are uploaded from several threads, so each one is sent without the shared SESSION
+    response = requests.post(fhir_server_url, data=json_dumps(bundle),
+                             headers={"Content-Type": "application/fhir+json"}, timeout=BUNDLE_TIMEOUT)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+
+
 def sync_biobanks():
     # Fetch data from the BBMRI-ERIC GraphQL API
-    response = requests.post(
-        'https://directory.bbmri-eric.eu/ERIC/directory/graphql',
-        json={'query': query}
-    )
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        json_data = response.json()
+    try:
+        content = fetch_graphql(DIRECTORY_GRAPHQL_URL, query)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch data: {e}")
+        return
 
-        # Populate Biobank objects from the JSON data
-        biobanks = populate_biobank_from_json(json_data)
+    # Populate Biobank objects from the JSON data
+    with gc_paused():
+        biobanks = populate_biobank_from_json(json_loads(content))
 
-        # Print FHIR-compliant JSON representation of each biobank
+    # Print FHIR-compliant JSON representation of each biobank
+    if DEBUG:
         for biobank in biobanks:
-            print(json.dumps(biobank.to_fhir().as_json(), indent=4))
-            blaze_client.BlazeClient(blaze_url='http://localhost:8080/fhir', blaze_password="",
-                                     blaze_username="").upload_biobank(biobank)
-    else:
-        print(f"Failed to fetch data: {response.status_code} - {response.text}")
+            print_fhir(biobank.to_fhir())
+
+    def upload_chunk(chunk: List[Biobank]) -> None:
+        try:
+            upload_biobank_bundle(BLAZE_URL, chunk)
+        except requests.exceptions.RequestException as e:
+            # The transaction is all-or-nothing, none of the biobanks in this chunk were uploaded
+            print(f"Failed to upload biobanks {chunk[0].identifier} to {chunk[-1].identifier}: {e}")
+
+    # Upload the biobanks in transaction Bundles of BUNDLE_SIZE resources each
+    chunks = [biobanks[i:i + BUNDLE_SIZE] for i in range(0, len(biobanks), BUNDLE_SIZE)]
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        list(executor.map(upload_chunk, chunks))
 
 
 def fetch_organization_fhir_id(fhir_server_url: str, identifier: str) -> str:
@@ -286,6 +473,11 @@ def fetch_organization_fhir_id(fhir_server_url: str, identifier: str) -> str:
     :param identifier: The identifier of the organization (e.g., "bbmri-eric:ID:CZ_MMCI").
     :return: The FHIR ID of the organization, or None if not found.
     """
+    # Found IDs are cached, organizations that are missing are looked up again next time
+    cached = _organization_fhir_ids.get((fhir_server_url, identifier))
+    if cached is not None:
+        return cached
+
     # Construct the search URL
     search_url = f"{fhir_server_url}/Organization"
 
@@ -296,16 +488,18 @@ def fetch_organization_fhir_id(fhir_server_url: str, identifier: str) -> str:
 
     try:
         # Send a GET request to the FHIR server
-        response = requests.get(search_url, params=params)
+        response = SESSION.get(search_url, params=params)
         response.raise_for_status()  # Raise an exception for HTTP errors
 
         # Parse the JSON response
-        search_result = response.json()
+        search_result = json_loads(response.content)
 
         # Check if any organizations were found
         if search_result.get("total", 0) > 0:
             # Return the FHIR ID of the first organization in the search results
-            return search_result["entry"][0]["resource"]["id"]
+            fhir_id = search_result["entry"][0]["resource"]["id"]
+            _organization_fhir_ids[(fhir_server_url, identifier)] = fhir_id
+            return fhir_id
         else:
             print(f"No organization found with identifier: {identifier}")
             return None
@@ -314,46 +508,93 @@ def fetch_organization_fhir_id(fhir_server_url: str, identifier: str) -> str:
         print(f"Failed to fetch organization: {e}")
         return None
 
+
+def fetch_organization_fhir_ids(fhir_server_url: str, identifiers: Iterable[str]) -> Dict[str, str]:
+    """
+    Fetch the FHIR IDs of many organizations, searching for up to SEARCH_BATCH_SIZE identifiers per request.
+
+    :param fhir_server_url: The base URL of the FHIR server (e.g., "https://fhir.example.com/fhir").
+    :param identifiers: The identifiers of the organizations (e.g., "bbmri-eric:ID:CZ_MMCI").
+    :return: The FHIR ID of each organization that was found, keyed by its identifier.
+    """
+    fhir_ids = {}
+    missing = []
+    for identifier in dict.fromkeys(identifiers):
+        cached = _organization_fhir_ids.get((fhir_server_url, identifier))
+        if cached is not None:
+            fhir_ids[identifier] = cached
+        else:
+            missing.append(identifier)
+
+    search_url = f"{fhir_server_url}/Organization"
+    for i in range(0, len(missing), SEARCH_BATCH_SIZE):
+        batch = missing[i:i + SEARCH_BATCH_SIZE]
+        # Comma-separated values are OR-ed by the FHIR search, commas inside a value are escaped
+        params = {
+            "identifier": ",".join(identifier.replace(",", "\\,") for identifier in batch),
+            "_count": len(batch)
+        }
+        wanted = set(batch)
+        url = search_url
+        # One identifier may match several Organizations, so follow the next links until all pages are read
+        while url is not None:
+            try:
+                response = SESSION.get(url, params=params)
+                response.raise_for_status()  # Raise an exception for HTTP errors
+            except requests.exceptions.RequestException as e:
+                print(f"Failed to fetch organizations: {e}")
+                break
+            search_result = json_loads(response.content)
+
+            # Match the found organizations back to the requested identifiers
+            for entry in search_result.get("entry", []):
+                resource = entry["resource"]
+                for resource_identifier in resource.get("identifier", []):
+                    value = resource_identifier.get("value")
+                    if value in wanted and value not in fhir_ids:
+                        fhir_ids[value] = resource["id"]
+                        _organization_fhir_ids[(fhir_server_url, value)] = resource["id"]
+
+            # The next link already carries the search parameters
+            url = next((link["url"] for link in search_result.get("link", []) if link.get("relation") == "next"), None)
+            params = None
+
+        unresolved = [identifier for identifier in batch if identifier not in fhir_ids]
+        if unresolved:
+            print(f"No organization found with identifiers: {', '.join(unresolved)}")
+
+    return fhir_ids
+
 def sync_networks():
-    response = requests.post(
-        'https://directory.bbmri-eric.eu/ERIC/directory/graphql',
-        json={'query': networks_query}
-    )
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        json_data = response.json()
+    try:
+        content = fetch_graphql(DIRECTORY_GRAPHQL_URL, networks_query)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch data: {e}")
+        return
 
-        # Populate Network objects from the JSON data
-        networks = populate_network_from_json(json_data)
+    # Populate Network objects from the JSON data
+    with gc_paused():
+        networks = populate_network_from_json(json_loads(content))
 
-        # Print FHIR-compliant JSON representation of each network
+    # Print FHIR-compliant JSON representation of each network
+    if DEBUG:
         for network in networks:
-            print(json.dumps(network.to_fhir(network_organization_fhir_id='DFFW3QMQC7KOYRHJ').as_json(), indent=4))
-            blaze_client.BlazeClient(blaze_url='http://localhost:8080/fhir', blaze_password="",
-                                     blaze_username="").upload_network(network)
-    else:
-        print(f"Failed to fetch data: {response.status_code} - {response.text}")
+            print_fhir(network.to_fhir(network_organization_fhir_id=NETWORK_ORGANIZATION_FHIR_ID))
+
+    upload_concurrently(blaze_client.BlazeClient.upload_network, networks)
 
 def sync_collections():
-    response = requests.post(
-        'https://directory-emx2-acc.molgenis.net/ERIC/directory/graphql',
-        json={'query': collections_query}
-    )
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        json_data = response.json()
+    try:
+        content = fetch_graphql(COLLECTIONS_GRAPHQL_URL, collections_query)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch data: {e}")
+        return
 
-        # Populate Network objects from the JSON data
-        collections = populate_collection_from_json(json.dumps(json_data))
+    with gc_paused():
+        json_data = json_loads(content)
 
-        # Print FHIR-compliant JSON representation of each network
-        for collection in collections:
-            blaze_client.BlazeClient(blaze_url='http://localhost:8080/fhir', blaze_password="",
-                                     blaze_username="").upload_collection(collection)
-    else:
-        print(f"Failed to fetch data: {response.status_code} - {response.text}")
+    # Build and upload each Collection as soon as it is populated
+    upload_concurrently(blaze_client.BlazeClient.upload_collection, iter_collections(json_data))
 
 
 #sync_biobanks()